@@ -1,23 +1,64 @@
 import asyncio
-from typing import Optional
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Optional, Tuple
 from contextlib import AsyncExitStack
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.types import CallToolResult, TextContent
 
-from anthropic import Anthropic
+from aioconsole import ainput
+from anthropic import AsyncAnthropic
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 import json
 
 load_dotenv()  # load environment variables from .env
 
+TOOL_CACHE_TTL = 60.0  # seconds a tool result stays fresh
+TOOL_CACHE_SIZE = 256  # maximum number of cached tool results
+MAX_CTX_BYTES = 200_000  # approximate size budget of the conversation sent to the model
+TOOL_RESULT_MAX_CHARS = 20_000  # longest tool result shown to the model in one piece
+PREFETCH_POSTS = 3  # number of top search results whose comments are prefetched
+PREFETCH_COMMENT_LIMIT = 20  # comments fetched per prefetched post
+
+# Client-side tool that pages through tool results truncated in the conversation
+FULL_RESULT_TOOL = {
+    "name": "get_full_tool_result",
+    "description": "Read more of a tool result that was truncated in the conversation.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "tool_call_id": {"type": "string", "description": "Id of the truncated tool call"},
+            "offset": {"type": "integer", "description": "Character offset to start reading from", "default": 0},
+        },
+        "required": ["tool_call_id"],
+    },
+}
+
+def _jsonable(obj):
+    """Convert SDK message objects so that they can be measured with json.dumps"""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+def _freeze(obj):
+    """Return a read-only copy of a JSON-like value: dicts become mappingproxies and lists tuples"""
+    if isinstance(obj, dict):
+        return MappingProxyType({key: _freeze(value) for key, value in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(value) for value in obj)
+    return obj
+
 class MCPClient:
     def __init__(self):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic()
+        self.anthropic = AsyncAnthropic()
+        self.openai = AsyncOpenAI()
         self.system_prompt = """
             You are a helpful assistant, and you will try your best to help the user.
             You won't give up on the first try, and you will be creative on solving the user's problem.
@@ -35,7 +76,19 @@ class MCPClient:
 
             continue the cycle until completion.
             """
+        self._anthropic_system = _freeze([{
+            "type": "text",
+            "text": self.system_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }])
         self.messages = []
+        self._tools = []
+        self._tool_defaults: dict[str, dict] = {}
+        self._anthropic_tools = ()
+        self._openai_tools = ()
+        self._tool_cache: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._tool_result_store: dict[str, str] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
 
     async def connect_to_server(self, server_script_path: str):
         """Connect to an MCP server
@@ -62,9 +115,190 @@ class MCPClient:
         await self.session.initialize()
         
         # List available tools
+        await self.refresh_tools()
+        print("\nConnected to server with tools:", [tool.name for tool in self._tools])
+
+    async def refresh_tools(self):
+        """Fetch the server's tools and rebuild the Anthropic and OpenAI tool schemas"""
         response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
+        self._tools = response.tools
+        self._tool_defaults = {
+            tool.name: {
+                name: schema["default"]
+                for name, schema in tool.inputSchema.get("properties", {}).items()
+                if isinstance(schema, dict) and "default" in schema
+            }
+            for tool in self._tools
+        }
+        anthropic_tools = [{
+            "name": tool.name,
+            "description": tool.description,
+            "input_schema": tool.inputSchema
+        } for tool in self._tools] + [dict(FULL_RESULT_TOOL)]
+        # Mark the end of the static prefix (tools, then system) for prompt caching
+        anthropic_tools[-1]["cache_control"] = {"type": "ephemeral"}
+        # Schemas are built once per refresh and shared by every concurrent request,
+        # so freeze them all the way down to catch accidental mutation
+        self._anthropic_tools = _freeze(anthropic_tools)
+        self._openai_tools = _freeze([
+            {
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool["description"],
+                    "parameters": tool["input_schema"],
+                },
+            }
+            for tool in anthropic_tools
+        ])
+
+    async def _cached_call_tool(self, tool_name: str, tool_args: dict):
+        """Call a tool, reusing a recent result for the same name and arguments"""
+        if tool_name == FULL_RESULT_TOOL["name"]:
+            return self._get_full_tool_result(**tool_args)
+
+        key = self._tool_cache_key(tool_name, tool_args)
+        cached = self._fresh_cached_result(key)
+        if cached is not None:
+            self._tool_cache.move_to_end(key)
+            return cached
+
+        # Share an identical call that is already in flight instead of issuing a duplicate
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = self._start_call(key, tool_name, tool_args)
+        # Shield the shared call so that one cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(inflight)
+
+    def _tool_cache_key(self, tool_name: str, tool_args: dict) -> str:
+        """Return the key that identifies a tool call in the tool cache and the in-flight map
+
+        Arguments left out are filled in from the tool's schema defaults, so that a call
+        relying on a default shares its key with one that passes the same value explicitly.
+        """
+        tool_args = {**self._tool_defaults.get(tool_name, {}), **tool_args}
+        return tool_name + "|" + json.dumps(tool_args, sort_keys=True)
+
+    def _fresh_cached_result(self, key: str):
+        """Return the cached result under key if it is younger than TOOL_CACHE_TTL, else None"""
+        cached = self._tool_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < TOOL_CACHE_TTL:
+            return cached[1]
+        return None
+
+    def _start_call(self, key: str, tool_name: str, tool_args: dict) -> asyncio.Task:
+        """Start a tool call in the background and register it as in flight under key"""
+        task = asyncio.create_task(self._call_and_cache(key, tool_name, tool_args))
+        self._inflight[key] = task
+        task.add_done_callback(lambda task, key=key: self._call_done(key, task))
+        return task
+
+    async def _call_and_cache(self, key: str, tool_name: str, tool_args: dict):
+        """Call a tool on the server and cache a successful result under key"""
+        result = await self.session.call_tool(tool_name, tool_args)
+        if not result.isError:
+            self._tool_cache[key] = (time.monotonic(), result)
+            self._tool_cache.move_to_end(key)
+            while len(self._tool_cache) > TOOL_CACHE_SIZE:
+                self._tool_cache.popitem(last=False)
+        return result
+
+    def _prefetch_comments(self, result):
+        """Start fetching comments for the top posts of a search_posts result in the background"""
+        if not any(tool.name == "get_submission_comments" for tool in self._tools):
+            return
+        posts = []
+        for block in result.content:
+            if block.type != "text":
+                continue
+            try:
+                value = json.loads(block.text)
+            except ValueError:
+                continue
+            posts.extend(value if isinstance(value, list) else [value])
+
+        for post in posts[:PREFETCH_POSTS]:
+            if not isinstance(post, dict) or "id" not in post:
+                continue
+            tool_args = {"submission": post["id"], "limit": PREFETCH_COMMENT_LIMIT}
+            key = self._tool_cache_key("get_submission_comments", tool_args)
+            if key in self._inflight or self._fresh_cached_result(key) is not None:
+                continue
+            self._start_call(key, "get_submission_comments", tool_args)
+
+    def _call_done(self, key: str, task: asyncio.Task):
+        """Forget a finished call; a successful result is already in the tool cache"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark the exception as retrieved when nobody awaited the call
+
+    def _get_full_tool_result(self, tool_call_id: str, offset: int = 0) -> CallToolResult:
+        """Return one page of a stored tool result starting at offset"""
+        text = self._tool_result_store.get(tool_call_id)
+        if text is None:
+            return CallToolResult(
+                content=[TextContent(type="text", text=f"No stored result for tool call {tool_call_id}")],
+                isError=True
+            )
+        end = offset + TOOL_RESULT_MAX_CHARS
+        page = text[offset:end]
+        if end < len(text):
+            page += self._truncation_note(tool_call_id, offset, end, len(text))
+        return CallToolResult(content=[TextContent(type="text", text=page)])
+
+    @staticmethod
+    def _truncation_note(tool_call_id: str, start: int, end: int, length: int) -> str:
+        """Return the note telling the model how to read the rest of a truncated tool result"""
+        return (
+            f"\n[Truncated: showing characters {start}-{end} of {length}. "
+            + f"Call {FULL_RESULT_TOOL['name']} with tool_call_id \"{tool_call_id}\" "
+            + f"and offset {end} to read more.]"
+        )
+
+    def _tool_result_text(self, tool_call_id: str, tool_name: str, result) -> str:
+        """Return the model-visible text of a tool result, storing the full text when it is truncated"""
+        if isinstance(result, Exception):
+            return str(result)
+        text = "\n".join(block.text for block in result.content if block.type == "text")
+        # Pages of stored results are already bounded and point back to the original tool call
+        if len(text) <= TOOL_RESULT_MAX_CHARS or tool_name == FULL_RESULT_TOOL["name"]:
+            return text
+        self._tool_result_store[tool_call_id] = text
+        return text[:TOOL_RESULT_MAX_CHARS] + self._truncation_note(tool_call_id, 0, TOOL_RESULT_MAX_CHARS, len(text))
+
+    @staticmethod
+    def _tool_call_ids(message) -> list:
+        """Return the ids of the tool calls whose results a message carries"""
+        if not isinstance(message, dict):
+            return []
+        if message["role"] == "tool":
+            return [message["tool_call_id"]]
+        if message["role"] == "user" and isinstance(message["content"], list):
+            return [block["tool_use_id"] for block in message["content"]
+                    if isinstance(block, dict) and block.get("type") == "tool_result"]
+        return []
+
+    def _trim_messages(self):
+        """Drop the oldest exchanges until the conversation fits in MAX_CTX_BYTES"""
+        def is_user_query(message):
+            return isinstance(message, dict) and message["role"] == "user" and isinstance(message["content"], str)
+
+        start = 1 if self.messages and isinstance(self.messages[0], dict) and self.messages[0]["role"] == "system" else 0
+        sizes = [len(json.dumps(message, default=_jsonable)) for message in self.messages]
+        total = sum(sizes)
+        while total > MAX_CTX_BYTES:
+            # Drop whole exchanges, so that tool results are never separated from their tool calls
+            end = next((i for i in range(start + 1, len(self.messages)) if is_user_query(self.messages[i])), None)
+            if end is None:
+                break
+            total -= sum(sizes[start:end])
+            # Stored full results of dropped tool calls can no longer be referenced
+            for message in self.messages[start:end]:
+                for tool_call_id in self._tool_call_ids(message):
+                    self._tool_result_store.pop(tool_call_id, None)
+            del self.messages[start:end]
+            del sizes[start:end]
 
     async def process_query_claude(self, query: str) -> str:
         print("process query using Claude")
@@ -76,57 +310,80 @@ class MCPClient:
             }
         )
 
-        response = await self.session.list_tools()
-        available_tools = [{ 
-            "name": tool.name,
-            "description": tool.description,
-            "input_schema": tool.inputSchema
-        } for tool in response.tools]
+        final_text = []
+        max_tokens = 1000
+        while True:
+            self._trim_messages()
 
-        # Initial Claude API call
-        response = self.anthropic.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=1000,
-            system=self.system_prompt,
-            messages=self.messages,
-            tools=available_tools
-        )
+            # Claude API call, streamed so that each tool call starts as soon as
+            # its block is complete while Claude is still generating the rest
+            response, tasks = await self._stream_claude(max_tokens)
+            self.messages.append({
+                "role": "assistant",
+                "content": response.content
+            })
 
-        # Process response and handle tool calls
-        final_text = []
+            # Process response and handle tool calls
+            tool_uses = [content for content in response.content if content.type == 'tool_use']
+            for content in response.content:
+                if content.type == 'text':
+                    final_text.append(content.text)
+                elif content.type == 'tool_use':
+                    final_text.append(f"[Calling tool {content.name} with args {content.input}]")
 
-        for content in response.content:
-            if content.type == 'text':
-                final_text.append(content.text)
-            elif content.type == 'tool_use':
-                tool_name = content.name
-                tool_args = content.input
-                
-                # Execute tool call
-                result = await self.session.call_tool(tool_name, tool_args)
-                final_text.append(f"[Calling tool {tool_name} with args {tool_args}]")
+            if not tool_uses:
+                break
 
-                # Continue conversation with tool results
-                if hasattr(content, 'text') and content.text:
-                    self.messages.append({
-                      "role": "assistant",
-                      "content": content.text
-                    })
-                self.messages.append({
-                    "role": "user", 
-                    "content": result.content
+            # Wait for all tool calls of this round
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Speculatively fetch comments for the top search results while Claude reads them
+            for content, result in zip(tool_uses, results):
+                if content.name == "search_posts" and not isinstance(result, Exception) and not result.isError:
+                    self._prefetch_comments(result)
+
+            # Continue conversation with tool results
+            tool_results = []
+            for content, result in zip(tool_uses, results):
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": content.id,
+                    "content": self._tool_result_text(content.id, content.name, result),
+                    "is_error": isinstance(result, Exception) or result.isError
                 })
+            self.messages.append({
+                "role": "user",
+                "content": tool_results
+            })
+            max_tokens = 10000
 
-                # Get next response from Claude
-                response = self.anthropic.messages.create(
-                    model="claude-3-7-sonnet-20250219",
-                    max_tokens=10000,
-                    messages=self.messages,
-                )
+        return "\n".join(final_text)
 
-                final_text.append(response.content[0].text)
+    async def _stream_claude(self, max_tokens: int):
+        """Stream one Claude response, starting a task for each tool_use block as soon as it is complete
 
-        return "\n".join(final_text)
+        Returns the final message and the tool call tasks, in the order of its tool_use blocks.
+        """
+        tasks = []
+        try:
+            async with self.anthropic.messages.stream(
+                model="claude-3-7-sonnet-20250219",
+                max_tokens=max_tokens,
+                system=self._anthropic_system,
+                messages=self.messages,
+                tools=self._anthropic_tools
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                        tasks.append(asyncio.create_task(
+                            self._cached_call_tool(event.content_block.name, event.content_block.input)
+                        ))
+                response = await stream.get_final_message()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return response, tasks
 
 
 
@@ -144,23 +401,12 @@ class MCPClient:
                 "content": query
             }
         )
-        response = await self.session.list_tools()
-        available_tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": tool.inputSchema,
-                },
-            }
-            for tool in response.tools
-        ]
+        available_tools = self._openai_tools
 
-        client = AsyncOpenAI()
+        self._trim_messages()
 
         # Initial OpenAI API call
-        response = await client.chat.completions.create(
+        response = await self.openai.chat.completions.create(
             model="o3-mini",
             messages=self.messages,
             tools=available_tools,
@@ -175,6 +421,7 @@ class MCPClient:
             if message.content:
                 final_text.append(message.content)
             if message.tool_calls:
+                tasks = []
                 for tool_call in message.tool_calls:
                     tool_name = tool_call.function.name
                     tool_args = tool_call.function.arguments
@@ -183,21 +430,28 @@ class MCPClient:
                     if isinstance(tool_args, str):
                         tool_args = json.loads(tool_args)
 
-                    # Execute tool call
-                    result = await self.session.call_tool(tool_name, tool_args)
+                    # Start each tool call as soon as its arguments are parsed, so it runs
+                    # while the remaining tool calls of this round are being prepared
+                    tasks.append(asyncio.create_task(self._cached_call_tool(tool_name, tool_args)))
                     final_text.append(f"[Calling tool {tool_name} with args {tool_args}]")
 
-                    # Continue conversation with tool results
-                    self.messages.append(message)
+                # Wait for all tool calls of this round
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+
+                # Continue conversation with tool results
+                self.messages.append(message)
+                for tool_call, result in zip(message.tool_calls, results):
                     self.messages.append(
                         {
                             "role": "tool",
                             "tool_call_id": tool_call.id,
-                            "content": result.content,
+                            "content": self._tool_result_text(tool_call.id, tool_call.function.name, result),
                         }
                     )
 
-                response = await client.chat.completions.create(
+                self._trim_messages()
+
+                response = await self.openai.chat.completions.create(
                     model="o3-mini",
                     messages=self.messages,
                     tools=available_tools,
@@ -217,7 +471,8 @@ class MCPClient:
         
         while True:
             try:
-                query = input("\nQuery: ").strip()
+                # Read without blocking so background tasks such as prefetches keep running
+                query = (await ainput("\nQuery: ")).strip()
                 
                 if query.lower() == 'quit':
                     break
@@ -242,6 +497,7 @@ class MCPClient:
     async def cleanup(self):
         """Clean up resources"""
         await self.exit_stack.aclose()
+        await self.openai.close()
 
 async def main():
     if len(sys.argv) < 2:
@@ -257,4 +513,9 @@ async def main():
 
 if __name__ == "__main__":
     import sys
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop
+    except ImportError:  # uvloop is optional and unavailable on Windows
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
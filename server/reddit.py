@@ -2,21 +2,102 @@ from typing import Any
 from mcp.server.fastmcp import FastMCP
 import os
 import asyncio
-import praw
+import asyncpraw
+import copy
 import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# The global Reddit instance is created lazily, since asyncpraw's HTTP session
+# must be created inside the running event loop.
+_reddit = None
+
+@asynccontextmanager
+async def lifespan(server):
+    """
+    Close the global Reddit instance, if one was created, when the server shuts down.
+    
+    Parameters:
+    - server: The FastMCP server.
+    """
+    global _reddit
+    try:
+        yield
+    finally:
+        if _reddit is not None:
+            await _reddit.close()
+            _reddit = None
+
 # Initialize FastMCP server
-mcp = FastMCP("reddit")
+mcp = FastMCP("reddit", lifespan=lifespan)
+
+def get_reddit():
+    """
+    Return the global Reddit instance, creating it from the environment credentials on first use.
+    
+    Returns:
+    - An asyncpraw Reddit instance.
+    """
+    global _reddit
+    if _reddit is None:
+        _reddit = asyncpraw.Reddit(
+            client_id=os.environ.get("REDDIT_CLIENT_ID"),
+            client_secret=os.environ.get("REDDIT_CLIENT_SECRET"),
+            user_agent=os.environ.get("REDDIT_USER_AGENT")
+        )
+    return _reddit
+
+# Cap concurrent Reddit requests to stay under Reddit's rate limits.
+_REDDIT_SEM = asyncio.Semaphore(int(os.environ.get("REDDIT_MAX_CONCURRENCY", "8")))
+
+# Short-lived caches of search and comment results, so that repeated identical
+# tool calls within an agent loop don't hit the Reddit API again.
+_SEARCH_CACHE: dict[tuple, tuple[float, list]] = {}
+_COMMENTS_CACHE: dict[tuple, tuple[float, list]] = {}
+_CACHE_TTL = 30.0
+_CACHE_SIZE = 256
+
+def _cache_get(cache: dict, key: tuple) -> Any:
+    """
+    Look up a fresh entry in one of the result caches.
+    
+    Parameters:
+    - cache: The cache to look in.
+    - key: The cache key.
+    
+    Returns:
+    - A deep copy of the cached list, or None if it is missing or older than _CACHE_TTL.
+    """
+    entry = cache.get(key)
+    if entry is None or time.time() - entry[0] >= _CACHE_TTL:
+        return None
+    return copy.deepcopy(entry[1])
 
-# Create a global Reddit instance using credentials from the environment
-reddit = praw.Reddit(
-    client_id=os.environ.get("REDDIT_CLIENT_ID"),
-    client_secret=os.environ.get("REDDIT_CLIENT_SECRET"),
-    user_agent=os.environ.get("REDDIT_USER_AGENT")
-)
+def _cache_put(cache: dict, key: tuple, value: list) -> None:
+    """
+    Store a result list in one of the result caches, keeping only the newest _CACHE_SIZE entries.
+    
+    Parameters:
+    - cache: The cache to store into.
+    - key: The cache key.
+    - value: The list to cache; a deep copy is stored so callers may mutate the original.
+    """
+    cache.pop(key, None)
+    cache[key] = (time.time(), copy.deepcopy(value))
+    while len(cache) > _CACHE_SIZE:
+        # Dicts keep insertion order, so the first key is the oldest entry.
+        del cache[next(iter(cache))]
+
+# Length in seconds of each natural language time filter.
+_TIME_FILTER_SECONDS = {
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+    "month": 30 * 86400,
+    "year": 365 * 86400,
+}
 
 def compute_threshold(time_filter: str) -> Any:
     """
@@ -28,27 +109,16 @@ def compute_threshold(time_filter: str) -> Any:
     Returns:
     - A UNIX timestamp corresponding to the start of the period, or None if time_filter is "all" or unrecognized.
     """
-    now = time.time()
-    if time_filter == "hour":
-        return now - 3600
-    elif time_filter == "day":
-        return now - 86400
-    elif time_filter == "week":
-        return now - (7 * 86400)
-    elif time_filter == "month":
-        return now - (30 * 86400)
-    elif time_filter == "year":
-        return now - (365 * 86400)
-    else:
-        return None
+    seconds = _TIME_FILTER_SECONDS.get(time_filter)
+    return None if seconds is None else time.time() - seconds
 
 # @mcp.tool()
-async def get_post_details(submission):
+def get_post_details(submission):
     """
     Extract and return key details from a submission.
     
     Parameters:
-    - submission: A PRAW submission object.
+    - submission: An asyncpraw submission object.
     
     Returns:
     - A dictionary containing post details such as id, title, selftext, URL, score, comment count, and creation time.
@@ -82,23 +152,21 @@ async def search_posts(query: str, subreddit: str = 'all', sort: str = 'relevanc
     Returns:
     - A list of dictionaries, each containing the details of a submission created within the specified time window.
     """
+    key = (query, subreddit, sort, time_filter, limit)
+    cached = _cache_get(_SEARCH_CACHE, key)
+    if cached is not None:
+        return cached
+
     print("Searching:", query)
-    subreddit_instance = reddit.subreddit(subreddit)
-    # Run the blocking search call in a thread to preserve async behavior.
-    submissions = await asyncio.to_thread(
-        lambda: list(subreddit_instance.search(query, sort=sort, time_filter=time_filter, limit=limit))
-    )
-    
     # Compute threshold based on natural language filter.
     threshold = compute_threshold(time_filter)
-    if threshold is not None:
-        submissions = [submission for submission in submissions if submission.created_utc >= threshold]
-    
-    # Directly call get_post_details for each submission.
-    details_list = []
-    for submission in submissions:
-        details = await get_post_details(submission)
-        details_list.append(details)
+    async with _REDDIT_SEM:
+        subreddit_instance = await get_reddit().subreddit(subreddit)
+        # Filter and extract post details in the same pass over the search results.
+        details_list = [get_post_details(submission) async for submission in
+                        subreddit_instance.search(query, sort=sort, time_filter=time_filter, limit=limit)
+                        if threshold is None or submission.created_utc >= threshold]
+    _cache_put(_SEARCH_CACHE, key, details_list)
     return details_list
 
 @mcp.tool()
@@ -107,15 +175,24 @@ async def get_submission_comments(submission, limit: int = 20):
     Retrieve a limited number of comments from a submission.
     
     Parameters:
-    - submission: A PRAW submission object.
+    - submission: An asyncpraw submission object, or a submission ID (as returned by search_posts).
     - limit: Maximum number of comments to retrieve.
     
     Returns:
     - A list of dictionaries, each containing comment id, body, score, and creation time.
     """
-    # Use asyncio.to_thread to run blocking calls in a separate thread.
-    await asyncio.to_thread(submission.comments.replace_more, limit=0)
-    comments_list = await asyncio.to_thread(lambda: submission.comments.list())
+    submission_id = submission if isinstance(submission, str) else submission.id
+    key = (submission_id, limit)
+    cached = _cache_get(_COMMENTS_CACHE, key)
+    if cached is not None:
+        return cached
+
+    async with _REDDIT_SEM:
+        if isinstance(submission, str):
+            # Fetching a submission by ID loads its comment tree in the same request.
+            submission = await get_reddit().submission(id=submission)
+        await submission.comments.replace_more(limit=0)
+        comments_list = submission.comments.list()
     results = []
     count = 0
     for comment in comments_list:
@@ -128,16 +205,17 @@ async def get_submission_comments(submission, limit: int = 20):
             'created_utc': comment.created_utc,
         })
         count += 1
+    _cache_put(_COMMENTS_CACHE, key, results)
     return results
 
 @mcp.tool()
 async def search_comments_in_posts(query: str, subreddit: str = 'all', post_limit: int = 10,
-                                   comment_limit: int = 20, time_filter: str = 'all'):
+                                   comment_limit: int = 20, time_filter: str = 'all', min_results: int = 0):
     """
     Asynchronously search for posts matching the query and extract a set number of comments from each post.
     
-    Since search_posts now returns post details (rather than submission objects), we re-fetch each submission
-    by ID before retrieving its comments.
+    Since search_posts now returns post details (rather than submission objects), comments are fetched by
+    submission ID, which loads each submission together with its comment tree in a single request.
     
     Parameters:
     - query: The search query.
@@ -145,20 +223,46 @@ async def search_comments_in_posts(query: str, subreddit: str = 'all', post_limi
     - post_limit: Maximum number of posts to search.
     - comment_limit: Maximum number of comments to retrieve per post.
     - time_filter: A natural language filter like "hour", "day", "week", "month", or "year". Defaults to "all".
+    - min_results: Return as soon as this many posts have their comments, skipping the slower ones.
+      If 0 (the default), wait for all posts.
     
     Returns:
-    - A list of dictionaries where each dictionary contains post details and its associated comments.
+    - A list of dictionaries where each dictionary contains post details and its associated comments,
+      in search order. A post whose comments could not be fetched has an empty comment list and an 'error' entry.
     """
     posts_details = await search_posts(query, subreddit=subreddit, sort="relevance",
                                        time_filter=time_filter, limit=post_limit)
-    results = []
-    for details in posts_details:
-        # Retrieve the full submission object by ID so that comments can be fetched.
-        submission = await asyncio.to_thread(lambda: reddit.submission(id=details['id']))
-        comments = await get_submission_comments(submission, limit=comment_limit)
-        details['comments'] = comments
-        results.append(details)
-    return results
+
+    async def _fetch_one(details):
+        # Fetch comments by ID; the submission is only loaded when they aren't cached.
+        try:
+            details['comments'] = await get_submission_comments(details['id'], limit=comment_limit)
+        except Exception as e:
+            # Keep the post so that one broken submission doesn't fail the whole batch.
+            details['comments'] = []
+            details['error'] = str(e)
+        return details
+
+    # Fetch the comments of every post concurrently, stopping once enough posts are done.
+    tasks = [asyncio.create_task(_fetch_one(details)) for details in posts_details]
+    wanted = min_results if 0 < min_results < len(tasks) else len(tasks)
+    completed = 0
+    try:
+        for future in asyncio.as_completed(tasks):
+            await future
+            completed += 1
+            if completed >= wanted:
+                break
+        return [details for task, details in zip(tasks, posts_details) if task.done()]
+    finally:
+        for task in tasks:
+            task.cancel()
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
+    try:
+        import uvloop
+    except ImportError:  # uvloop is optional and unavailable on Windows
+        mcp.run(transport='stdio')
+    else:
+        # Equivalent to mcp.run(transport='stdio'), but on a uvloop event loop.
+        uvloop.run(mcp.run_stdio_async())